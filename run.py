@@ -4,14 +4,24 @@
 
 import argparse
 import csv
+import hashlib
+import json
+import math
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from statistics import median
-from typing import Any, Dict, List, Optional, Tuple
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
 
+import numpy as np
 import requests
+import simdjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 FINDING_ENDPOINT = "https://svcs.ebay.com/services/search/FindingService/v1"
 
@@ -20,9 +30,54 @@ DEFAULT_PAYMENT_FEE_RATE = 0.029
 DEFAULT_PAYMENT_FIXED_FEE = 0.30
 DEFAULT_SHIPPING_OUT = 4.50
 
+# One pooled keep-alive session for every Finding call (avoids a TLS handshake per page).
+# At most --workers + SOLD_PAGE_WORKERS calls are in flight (12 by default), which fits the
+# pool; pool_block makes pool_maxsize a hard cap if --workers is raised further. Transient
+# 429/5xx responses are retried with backoff.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        pool_block=True,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,  # let raise_for_status() report the final response
+        ),
+    ),
+)
+
+# simdjson parsers reuse one internal buffer and aren't thread-safe: one per worker thread.
+# A parser can only be reused once nothing references its previous document, so callers
+# must extract what they need from a response before making the next call.
+_LOCAL = threading.local()
+
 MIN_PROFIT_GBP = 25.0
 MIN_MARGIN = 0.25
 
+# Sold listings are sampled from the last SOLD_WINDOW_DAYS days.
+SOLD_WINDOW_DAYS = 90
+
+# Sold samples over that window barely move minute to minute; reuse them across re-runs.
+SOLD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ebay-flipper")
+SOLD_CACHE_TTL = 3600  # seconds
+
+# Keywords scanned concurrently; each keyword worker has one Finding call in flight at a time.
+DEFAULT_WORKERS = 8
+# Sold-result pages 2..N are prefetched on this one shared pool, so at most
+# SOLD_PAGE_WORKERS of them are in flight across all keywords.
+SOLD_PAGE_WORKERS = 4
+_SOLD_PAGE_POOL = ThreadPoolExecutor(max_workers=SOLD_PAGE_WORKERS, thread_name_prefix="sold-page")
+
+# Be polite to the API: successive Finding calls start at least MIN_CALL_INTERVAL seconds
+# apart, across all threads.
+MIN_CALL_INTERVAL = 0.05
+_CALL_LOCK = threading.Lock()
+_next_call_at = 0.0
+
 
 def _iso_utc(dt: datetime) -> str:
     # eBay Finding API wants ISO 8601; UTC is safest
@@ -31,26 +86,55 @@ def _iso_utc(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
 
 
+def _json_parser() -> simdjson.Parser:
+    parser = getattr(_LOCAL, "parser", None)
+    if parser is None:
+        parser = _LOCAL.parser = simdjson.Parser()
+    return parser
+
+
+def _wait_for_call_turn() -> None:
+    # Reserve the next start slot under the lock, then sleep outside it.
+    global _next_call_at
+    with _CALL_LOCK:
+        now = time.monotonic()
+        start = max(now, _next_call_at)
+        _next_call_at = start + MIN_CALL_INTERVAL
+    if start > now:
+        time.sleep(start - now)
+
+
+@lru_cache(maxsize=None)
+def _base_query(operation: str, global_id: str, app_id: str) -> str:
+    # The per-operation part of the query string never changes within a run: encode it once.
+    return urlencode(
+        {
+            "OPERATION-NAME": operation,
+            "SERVICE-VERSION": "1.13.0",
+            "SECURITY-APPNAME": app_id,
+            "GLOBAL-ID": global_id,
+            "RESPONSE-DATA-FORMAT": "JSON",
+            "REST-PAYLOAD": "true",
+        }
+    )
+
+
 def ebay_finding_call(
     app_id: str,
     operation: str,
     global_id: str,
     params: Dict[str, Any],
     timeout: int = 30,
-) -> Dict[str, Any]:
-    base_params = {
-        "OPERATION-NAME": operation,
-        "SERVICE-VERSION": "1.13.0",
-        "SECURITY-APPNAME": app_id,
-        "GLOBAL-ID": global_id,
-        "RESPONSE-DATA-FORMAT": "JSON",
-        "REST-PAYLOAD": "true",
-    }
-    merged = {**base_params, **params}
+) -> simdjson.Object:
+    # Returns the lazy "<operation>Response" object. It pins this thread's parser, so read
+    # what you need from it and drop it before the next call (don't hold it across calls).
+    url = f"{FINDING_ENDPOINT}?{_base_query(operation, global_id, app_id)}&{urlencode(params)}"
 
-    r = requests.get(FINDING_ENDPOINT, params=merged, timeout=timeout)
+    _wait_for_call_turn()
+    r = _SESSION.get(url, timeout=timeout)
     r.raise_for_status()
-    data = r.json()
+    # Lazy document: only the fields we actually read get turned into Python objects.
+    data = _json_parser().parse(r.content)
 
     # Basic API error handling
     resp_key = f"{operation}Response"
@@ -66,36 +150,51 @@ def ebay_finding_call(
     return root
 
 
-def _get_price(obj: Dict[str, Any]) -> Optional[float]:
-    # Many eBay Finding fields are lists-of-dicts-of-lists.
+# Many eBay Finding fields are lists-of-dicts-of-lists. Per-item leaves are read with one
+# JSON-pointer lookup each (done inside simdjson) rather than a chain of .get(...)[0] hops.
+_PRICE_PTR = "/sellingStatus/0/currentPrice/0/__value__"
+_SHIPPING_PTR = "/shippingInfo/0/shippingServiceCost/0/__value__"
+
+
+def _leaf(obj: Any, pointer: str) -> Any:
     try:
-        return float(obj.get("__value__"))
+        return obj.at_pointer(pointer)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _get_price(obj: Any, pointer: str) -> Optional[float]:
+    try:
+        return float(_leaf(obj, pointer))
     except Exception:
         return None
 
 
-def parse_active_items(root: Dict[str, Any]) -> List[Dict[str, Any]]:
+def _item_total(it: Any) -> Optional[Tuple[float, float]]:
+    # (price, shipping) for one listing; None when it has no usable price.
+    price = _get_price(it, _PRICE_PTR)
+    if price is None:
+        return None
+    shipping = _get_price(it, _SHIPPING_PTR)
+    return price, (shipping if shipping is not None else 0.0)
+
+
+def parse_active_items(root: simdjson.Object, max_buy: float = math.inf) -> List[Dict[str, Any]]:
+    # Listings whose price+shipping is above max_buy can't meet the profit/margin
+    # thresholds, so they are skipped before any of their other fields are read.
     items = root.get("searchResult", [{}])[0].get("item", [])
     out: List[Dict[str, Any]] = []
     for it in items:
-        title = (it.get("title", [""])[0] or "").strip()
-        item_id = (it.get("itemId", [""])[0] or "").strip()
-        url = (it.get("viewItemURL", [""])[0] or "").strip()
-
-        selling = it.get("sellingStatus", [{}])[0]
-        price_obj = selling.get("currentPrice", [{}])[0]
-        price = _get_price(price_obj)
-
-        shipping = 0.0
-        ship_info = it.get("shippingInfo", [{}])[0]
-        ship_obj = ship_info.get("shippingServiceCost", [{}])
-        if isinstance(ship_obj, list) and ship_obj:
-            ship_val = _get_price(ship_obj[0])
-            if ship_val is not None:
-                shipping = ship_val
-
-        if price is None:
+        total = _item_total(it)
+        if total is None:
             continue
+        price, shipping = total
+        if price + shipping > max_buy:
+            continue
+
+        title = (_leaf(it, "/title/0") or "").strip()
+        item_id = (_leaf(it, "/itemId/0") or "").strip()
+        url = (_leaf(it, "/viewItemURL/0") or "").strip()
 
         out.append(
             {
@@ -110,26 +209,13 @@ def parse_active_items(root: Dict[str, Any]) -> List[Dict[str, Any]]:
     return out
 
 
-def parse_sold_totals(root: Dict[str, Any]) -> List[float]:
+def parse_sold_totals(root: simdjson.Object) -> List[float]:
     items = root.get("searchResult", [{}])[0].get("item", [])
     totals: List[float] = []
     for it in items:
-        selling = it.get("sellingStatus", [{}])[0]
-        price_obj = selling.get("currentPrice", [{}])[0]
-        price = _get_price(price_obj)
-
-        shipping = 0.0
-        ship_info = it.get("shippingInfo", [{}])[0]
-        ship_obj = ship_info.get("shippingServiceCost", [{}])
-        if isinstance(ship_obj, list) and ship_obj:
-            ship_val = _get_price(ship_obj[0])
-            if ship_val is not None:
-                shipping = ship_val
-
-        if price is None:
-            continue
-
-        totals.append(price + shipping)
+        total = _item_total(it)
+        if total is not None:
+            totals.append(total[0] + total[1])
     return totals
 
 
@@ -138,6 +224,7 @@ def find_active(
     keyword: str,
     active_limit: int,
     global_id: str,
+    max_buy: float = math.inf,
 ) -> List[Dict[str, Any]]:
     root = ebay_finding_call(
         app_id=app_id,
@@ -150,18 +237,20 @@ def find_active(
             # UK focus via global_id EBAY-GB; you can also add categoryId if you want.
         },
     )
-    return parse_active_items(root)
+    return parse_active_items(root, max_buy)
 
 
-def find_sold_totals(
+def _fetch_sold_page(
     app_id: str,
     keyword: str,
-    sold_limit: int,
     global_id: str,
-    days: int = 90,
-) -> List[float]:
-    end_from = _iso_utc(datetime.now(timezone.utc) - timedelta(days=days))
-
+    end_from: str,
+    page: int,
+    per_page: int,
+) -> Tuple[List[float], int]:
+    # Returns (price+shipping totals, totalPages). Only the floats outlive this call,
+    # so each parsed page is freed before the next one is fetched.
+    #
     # Completed items API:
     # itemFilter(0)=SoldItemsOnly true
     # itemFilter(1)=EndTimeFrom <iso>
@@ -171,7 +260,8 @@ def find_sold_totals(
         global_id=global_id,
         params={
             "keywords": keyword,
-            "paginationInput.entriesPerPage": str(min(sold_limit, 100)),
+            "paginationInput.entriesPerPage": str(per_page),
+            "paginationInput.pageNumber": str(page),
             "sortOrder": "EndTimeSoonest",
             "itemFilter(0).name": "SoldItemsOnly",
             "itemFilter(0).value": "true",
@@ -179,53 +269,110 @@ def find_sold_totals(
             "itemFilter(1).value": end_from,
         },
     )
+    total_pages = int(root.get("paginationOutput", [{}])[0].get("totalPages", ["1"])[0])
+    return parse_sold_totals(root), total_pages
 
-    totals = parse_sold_totals(root)
-
-    # If they asked for more than 100, page (Finding API max 100 per page).
-    page = 1
-    while len(totals) < sold_limit:
-        total_pages = int(root.get("paginationOutput", [{}])[0].get("totalPages", ["1"])[0])
-        page += 1
-        if page > total_pages:
-            break
-
-        root = ebay_finding_call(
-            app_id=app_id,
-            operation="findCompletedItems",
-            global_id=global_id,
-            params={
-                "keywords": keyword,
-                "paginationInput.entriesPerPage": "100",
-                "paginationInput.pageNumber": str(page),
-                "sortOrder": "EndTimeSoonest",
-                "itemFilter(0).name": "SoldItemsOnly",
-                "itemFilter(0).value": "true",
-                "itemFilter(1).name": "EndTimeFrom",
-                "itemFilter(1).value": end_from,
-            },
-        )
-        totals.extend(parse_sold_totals(root))
 
-        # be polite to the API
-        time.sleep(0.1)
+def find_sold_totals(
+    app_id: str,
+    keyword: str,
+    sold_limit: int,
+    global_id: str,
+    end_from: str,
+) -> List[float]:
+    totals, total_pages = _fetch_sold_page(
+        app_id, keyword, global_id, end_from, page=1, per_page=min(sold_limit, 100)
+    )
+
+    # If they asked for more than 100, page (Finding API max 100 per page). Page 1 tells
+    # us how many pages exist, so the rest are prefetched on the shared page pool.
+    last_page = min(math.ceil(sold_limit / 100), total_pages)
+    if last_page > 1:
+        fetch = partial(_fetch_sold_page, app_id, keyword, global_id, end_from, per_page=100)
+        for page_totals, _ in _SOLD_PAGE_POOL.map(fetch, range(2, last_page + 1)):
+            totals.extend(page_totals)
 
     return totals[:sold_limit]
 
 
+def _sold_cache_path(keyword: str, sold_limit: int, global_id: str) -> str:
+    # Keyed on the window length, not end_from: the exact start moves every second.
+    key = hashlib.sha256(
+        f"{keyword}|{sold_limit}|{global_id}|{SOLD_WINDOW_DAYS}".encode("utf-8")
+    ).hexdigest()
+    return os.path.join(SOLD_CACHE_DIR, f"sold-{key}.json")
+
+
+@lru_cache(maxsize=512)
+def cached_sold_totals(
+    app_id: str,
+    keyword: str,
+    sold_limit: int,
+    global_id: str,
+    end_from: str,
+) -> Tuple[float, ...]:
+    # find_sold_totals behind an in-process LRU plus an on-disk cache with a TTL.
+    path = _sold_cache_path(keyword, sold_limit, global_id)
+    try:
+        if os.path.getmtime(path) + SOLD_CACHE_TTL > time.time():
+            with open(path, encoding="utf-8") as f:
+                return tuple(json.load(f))
+    except (OSError, ValueError):
+        pass  # missing, unreadable or corrupt: just refetch
+
+    totals = find_sold_totals(app_id, keyword, sold_limit, global_id, end_from)
+
+    try:
+        os.makedirs(SOLD_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(totals, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[{keyword}] Could not write sold cache: {e}", file=sys.stderr)
+
+    return tuple(totals)
+
+
+def _median(values: Sequence[float]) -> float:
+    # O(n) introselect in place on our own float64 copy, instead of a full sort.
+    arr = np.fromiter(values, dtype=np.float64, count=len(values))
+    mid = arr.size // 2
+    arr.partition(mid)
+    if arr.size % 2:
+        return float(arr[mid])
+    # Everything left of mid is <= arr[mid] after partitioning, so its max is the lower middle.
+    return 0.5 * (float(arr[:mid].max()) + float(arr[mid]))
+
+
+def max_buy_price(
+    median_sold: float,
+    ebay_fee_rate: float,
+    payment_fee_rate: float,
+    payment_fixed_fee: float,
+    shipping_out: float,
+) -> float:
+    # Highest buy price (item + shipping) that can still pass both thresholds in compute_row:
+    #   profit = net - buy >= MIN_PROFIT_GBP       ->  buy <= net - MIN_PROFIT_GBP
+    #   margin = (net - buy) / buy >= MIN_MARGIN   ->  buy <= net / (1 + MIN_MARGIN)
+    # net is built exactly as compute_row builds it; the small slack covers float rounding
+    # in the rearranged inequalities, since compute_row still applies the exact thresholds.
+    ebay_fee = median_sold * ebay_fee_rate
+    payment_fee = median_sold * payment_fee_rate + payment_fixed_fee
+    net = median_sold - ebay_fee - payment_fee - shipping_out
+    return min(net - MIN_PROFIT_GBP, net / (1 + MIN_MARGIN)) + 1e-6
+
+
 def compute_row(
     keyword: str,
     active: Dict[str, Any],
-    sold_totals: List[float],
+    median_sold: float,
+    sold_sample_size: int,
     ebay_fee_rate: float,
     payment_fee_rate: float,
     payment_fixed_fee: float,
     shipping_out: float,
 ) -> Optional[Dict[str, Any]]:
-    if len(sold_totals) == 0:
-        return None
-
-    median_sold = float(median(sold_totals))
     ebay_fee = median_sold * ebay_fee_rate
     payment_fee = median_sold * payment_fee_rate + payment_fixed_fee
 
@@ -243,17 +390,61 @@ def compute_row(
         "active_title": active["active_title"],
         "active_item_id": active["active_item_id"],
         "active_url": active["active_url"],
-        "active_buy_price_gbp": round(active_buy, 2),
-        "median_sold_price_gbp": round(median_sold, 2),
-        "sold_sample_size": len(sold_totals),
-        "ebay_fee_gbp": round(ebay_fee, 2),
-        "payment_fee_gbp": round(payment_fee, 2),
-        "shipping_out_gbp": round(shipping_out, 2),
-        "expected_profit_gbp": round(expected_profit, 2),
-        "margin_percent": round(margin * 100, 1),
+        "active_buy_price_gbp": active_buy,
+        "median_sold_price_gbp": median_sold,
+        "sold_sample_size": sold_sample_size,
+        "ebay_fee_gbp": ebay_fee,
+        "payment_fee_gbp": payment_fee,
+        "shipping_out_gbp": shipping_out,
+        "expected_profit_gbp": expected_profit,
+        "margin_percent": margin * 100,
     }
 
 
+def process_keyword(kw: str, args: argparse.Namespace, end_from: str) -> List[Dict[str, Any]]:
+    try:
+        fetch_sold = find_sold_totals if args.no_cache else cached_sold_totals
+        sold_totals = fetch_sold(args.app_id, kw, args.sold_limit, args.global_id, end_from)
+        if len(sold_totals) == 0:
+            return []
+
+        # Median once per keyword, not once per active listing.
+        median_sold = _median(sold_totals)
+        max_buy = max_buy_price(
+            median_sold,
+            args.ebay_fee_rate,
+            args.payment_fee_rate,
+            args.payment_fixed_fee,
+            args.shipping_out,
+        )
+        if max_buy <= 0:
+            return []  # nothing at any price would qualify; skip the active search
+
+        active_items = find_active(args.app_id, kw, args.active_limit, args.global_id, max_buy=max_buy)
+    except requests.HTTPError as e:
+        print(f"[{kw}] HTTP error: {e}", file=sys.stderr)
+        return []
+    except Exception as e:
+        print(f"[{kw}] Error: {e}", file=sys.stderr)
+        return []
+
+    rows: List[Dict[str, Any]] = []
+    for a in active_items:
+        row = compute_row(
+            keyword=kw,
+            active=a,
+            median_sold=median_sold,
+            sold_sample_size=len(sold_totals),
+            ebay_fee_rate=args.ebay_fee_rate,
+            payment_fee_rate=args.payment_fee_rate,
+            payment_fixed_fee=args.payment_fixed_fee,
+            shipping_out=args.shipping_out,
+        )
+        if row:
+            rows.append(row)
+    return rows
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument(
@@ -266,6 +457,8 @@ def main() -> int:
     ap.add_argument("--output", default="results.csv")
     ap.add_argument("--global-id", default="EBAY-GB", help="EBAY-GB for UK")
     ap.add_argument("--app-id", default=os.environ.get("EBAY_APP_ID", "").strip())
+    ap.add_argument("--no-cache", action="store_true", help="Always refetch sold listings from eBay")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Keywords scanned in parallel")
 
     ap.add_argument("--ebay-fee-rate", type=float, default=DEFAULT_EBAY_FEE_RATE)
     ap.add_argument("--payment-fee-rate", type=float, default=DEFAULT_PAYMENT_FEE_RATE)
@@ -274,40 +467,22 @@ def main() -> int:
 
     args = ap.parse_args()
 
+    if args.workers < 1:
+        print("--workers must be at least 1.", file=sys.stderr)
+        return 2
+
     if not args.app_id:
         print('Missing App ID. Set EBAY_APP_ID env var or pass --app-id "YOUR_APP_ID".', file=sys.stderr)
         return 2
 
-    keywords = [k.strip() for k in args.keywords.split(",") if k.strip()]
+    # Case/whitespace variants of the same keyword would only repeat the same API calls.
+    keywords = list(dict.fromkeys(" ".join(k.lower().split()) for k in args.keywords.split(",") if k.strip()))
     if not keywords:
         print("No keywords provided.", file=sys.stderr)
         return 2
 
-    rows: List[Dict[str, Any]] = []
-
-    for kw in keywords:
-        try:
-            active_items = find_active(args.app_id, kw, args.active_limit, args.global_id)
-            sold_totals = find_sold_totals(args.app_id, kw, args.sold_limit, args.global_id, days=90)
-        except requests.HTTPError as e:
-            print(f"[{kw}] HTTP error: {e}", file=sys.stderr)
-            continue
-        except Exception as e:
-            print(f"[{kw}] Error: {e}", file=sys.stderr)
-            continue
-
-        for a in active_items:
-            row = compute_row(
-                keyword=kw,
-                active=a,
-                sold_totals=sold_totals,
-                ebay_fee_rate=args.ebay_fee_rate,
-                payment_fee_rate=args.payment_fee_rate,
-                payment_fixed_fee=args.payment_fixed_fee,
-                shipping_out=args.shipping_out,
-            )
-            if row:
-                rows.append(row)
+    # One sold-items window for the whole run, so every keyword queries the same range.
+    end_from = _iso_utc(datetime.now(timezone.utc) - timedelta(days=SOLD_WINDOW_DAYS))
 
     # Write CSV
     fieldnames = [
@@ -325,13 +500,42 @@ def main() -> int:
         "margin_percent",
     ]
 
+    n_rows = 0
     with open(args.output, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        for r in rows:
-            w.writerow(r)
-
-    print(f"Wrote {len(rows)} rows to {args.output}")
+        w = csv.writer(f)
+        w.writerow(fieldnames)
+
+        # Each keyword is independent, blocking HTTP work, so overlap them on threads.
+        # Rows are written (from this thread only) in the order keywords finish, so a slow
+        # keyword doesn't hold back the others and the file can be tailed mid-scan.
+        # No list of futures is kept: as_completed drops each one once yielded, and we drop
+        # its rows after writing, so finished keywords don't stay in memory.
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            for fut in as_completed([ex.submit(process_keyword, kw, args, end_from) for kw in keywords]):
+                rows = fut.result()
+                # Rows keep full precision in memory; round only when serialising.
+                w.writerows(
+                    (
+                        r["keyword"],
+                        r["active_title"],
+                        r["active_item_id"],
+                        r["active_url"],
+                        f"{r['active_buy_price_gbp']:.2f}",
+                        f"{r['median_sold_price_gbp']:.2f}",
+                        r["sold_sample_size"],
+                        f"{r['ebay_fee_gbp']:.2f}",
+                        f"{r['payment_fee_gbp']:.2f}",
+                        f"{r['shipping_out_gbp']:.2f}",
+                        f"{r['expected_profit_gbp']:.2f}",
+                        f"{r['margin_percent']:.1f}",
+                    )
+                    for r in rows
+                )
+                f.flush()
+                n_rows += len(rows)
+                del fut, rows
+
+    print(f"Wrote {n_rows} rows to {args.output}")
     return 0
 
 